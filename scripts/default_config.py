@@ -78,6 +78,7 @@ def get_default_config():
     cfg.data.sources = ['market1501']
     cfg.data.targets = ['market1501']
     cfg.data.workers = 4  # number of data loading workers
+    cfg.data.pin_memory = True  # use page-locked memory for batches to copy them to GPU asynchronously
     cfg.data.split_id = 0  # Split index
     cfg.data.height = 256  # image height
     cfg.data.width = 128  # image width
@@ -146,6 +147,10 @@ def get_default_config():
     cfg.train.ema = CN()
     cfg.train.ema.enable = False
     cfg.train.ema.ema_decay = 0.999
+    cfg.train.mix_precision = False  # run forward/backward in FP16 with dynamic loss scaling
+    cfg.train.channels_last = False  # keep model weights and input images in the NHWC memory format
+    cfg.train.torch_compile = False  # fuse model kernels with torch.compile (requires torch >= 2.0, untested in this repo)
+    cfg.train.find_unused_parameters = False  # force DDP to look for parameters w/o gradients in each iteration
 
     # optimizer
     cfg.sgd = CN()
@@ -490,6 +495,7 @@ def imagedata_kwargs(cfg):
         'batch_size_train': cfg.train.batch_size,
         'batch_size_test': cfg.test.batch_size,
         'workers': cfg.data.workers,
+        'pin_memory': cfg.data.pin_memory,
         'batch_num_instances': cfg.sampler.batch_num_instances,
         'epoch_num_instances': cfg.sampler.epoch_num_instances,
         'fill_instances': cfg.sampler.fill_instances,
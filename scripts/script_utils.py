@@ -1,11 +1,15 @@
 import argparse
+import os
+import socket
+from contextlib import closing
 
 from pprint import pformat
 from torch.onnx.symbolic_helper import parse_args
 import torch
+import torch.distributed as dist
+import torch.nn as nn
 
 import torchreid
-from torchreid.ops import DataParallel
 from torchreid.utils import (load_pretrained_weights, check_isfile,
                                 resume_from_checkpoint, get_model_attr)
 
@@ -58,8 +62,87 @@ def reset_config(cfg, args):
         cfg.mutual_learning.aux_configs = args.auxiliary_models_cfg
 
 
+def find_free_port():
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+def setup_ddp(rank, world_size, master_port=None):
+    os.environ.setdefault('MASTER_ADDR', 'localhost')
+    if master_port is not None:
+        os.environ['MASTER_PORT'] = str(master_port)
+    else:
+        os.environ.setdefault('MASTER_PORT', str(find_free_port()))
+    dist.init_process_group('nccl', rank=rank, world_size=world_size)
+    torch.cuda.set_device(rank)
+
+
+def cleanup_ddp():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process():
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def compile_model(model, mode='reduce-overhead'):
+    if not hasattr(torch, 'compile'):
+        print(f'Warning: torch.compile is not available in torch {torch.__version__}, the model is run eagerly')
+        return model
+
+    return torch.compile(model, mode=mode, fullgraph=False)
+
+
+def convert_sync_batchnorm_2d(model):
+    # Unlike nn.SyncBatchNorm.convert_sync_batchnorm, BatchNorm1d of the embedding heads is kept as is,
+    # so the models can treat nn.SyncBatchNorm as a converted 2D BN (bn_eval, BN-aware regularizers)
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.BatchNorm2d):
+                setattr(module, name, nn.SyncBatchNorm.convert_sync_batchnorm(child))
+
+    return model
+
+
+def needs_unused_parameters_search(cfg, num_classes, frozen=False):
+    # DDP fails if a parameter gets no gradient in an iteration, unless it looks for such parameters
+    if cfg.train.find_unused_parameters or frozen:
+        return True
+    # layers are frozen after the model has been wrapped
+    if cfg.train.fixbase_epoch > 0 or cfg.model.bn_frozen:
+        return True
+
+    # heads of a target or an attribute are skipped when a batch has no samples for them
+    num_targets = len(num_classes) if isinstance(num_classes, (tuple, list)) else 1
+    use_attr = any(attr_size is not None and attr_size > 0 for attr_size in cfg.attr_loss.num_classes)
+
+    return num_targets > 1 or use_attr
+
+
+def put_on_the_ddp(model, local_rank, torch_compile=False, find_unused_parameters=False):
+    # DP computes BN statistics over the whole batch, so sync them between ranks to keep the same behaviour
+    model = convert_sync_batchnorm_2d(model)
+    model = model.cuda(local_rank)
+    if torch_compile:
+        # CUDA graphs of 'reduce-overhead' do not mix with DDP gradient hooks
+        model = compile_model(model, mode='default')
+
+    return nn.parallel.DistributedDataParallel(model, device_ids=[local_rank], output_device=local_rank,
+                                               find_unused_parameters=find_unused_parameters)
+
+
 def build_datamanager(cfg, classification_classes_filter=None):
-    return torchreid.data.ImageDataManager(filter_classes=classification_classes_filter, **imagedata_kwargs(cfg))
+    data_kwargs = imagedata_kwargs(cfg)
+    if is_distributed():
+        data_kwargs.update(num_replicas=dist.get_world_size(), rank=dist.get_rank(), seed=cfg.train.seed)
+
+    return torchreid.data.ImageDataManager(filter_classes=classification_classes_filter, **data_kwargs)
 
 def build_auxiliary_model(config_file, num_classes, use_gpu, device_ids=None, lr=None,
                           nncf_aux_config_file=None,
@@ -94,33 +177,40 @@ def build_auxiliary_model(config_file, num_classes, use_gpu, device_ids=None, lr
     if aux_cfg.use_gpu:
         assert device_ids is not None
 
-        if len(device_ids) > 1:
-            model = DataParallel(model, device_ids=device_ids, output_device=0).cuda(device_ids[0])
+        if aux_cfg.train.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        if is_distributed():
+            # aux models are frozen when NNCF is used
+            find_unused_parameters = needs_unused_parameters_search(aux_cfg, num_classes,
+                                                                    frozen=nncf_aux_config_file is not None)
+            model = put_on_the_ddp(model, device_ids[0], aux_cfg.train.torch_compile, find_unused_parameters)
         else:
             model = model.cuda(device_ids[0])
+            if aux_cfg.train.torch_compile:
+                model = compile_model(model)
 
     return model, optimizer, scheduler
 
 
 @parse_args('v', 'i', 'v', 'v', 'f', 'i')
 def group_norm_symbolic(g, input_blob, num_groups, weight, bias, eps, cudnn_enabled):
-    from torch.onnx.symbolic_opset9 import reshape, mul, add, reshape_as
+    from torch.onnx.symbolic_opset9 import reshape, reshape_as
 
     channels_num = input_blob.type().sizes()[1]
 
     if num_groups == channels_num:
         output = g.op('InstanceNormalization', input_blob, weight, bias, epsilon_f=eps)
     else:
-        # Reshape from [n, g * cg, h, w] to [1, n * g, cg * h, w].
+        # Reshape from [n, g * cg, h, w] to [n, g, cg * h, w].
         x = reshape(g, input_blob, [0, num_groups, -1, 0])
-        x = reshape(g, x, [1, -1, 0, 0])
-        # Normalize channel-wise.
+        # Normalize group-wise.
         x = g.op('MeanVarianceNormalization', x, axes_i=[2, 3])
         # Reshape back.
         x = reshape_as(g, x, input_blob)
-        # Apply affine transform.
-        x = mul(g, x, reshape(g, weight, [1, channels_num, 1, 1]))
-        output = add(g, x, reshape(g, bias, [1, channels_num, 1, 1]))
+        # Apply affine transform as a single scale-shift op (BN with zero mean and unit variance).
+        zeros = g.op('Constant', value_t=torch.zeros(channels_num))
+        ones = g.op('Constant', value_t=torch.ones(channels_num))
+        output = g.op('BatchNormalization', x, weight, bias, zeros, ones, epsilon_f=0.0)
 
     return output
 
@@ -134,52 +224,42 @@ def is_config_parameter_set_from_command_line(cmd_line_opts, parameter_name):
     return (parameter_name in key_names)
 
 
-def put_main_model_on_the_device(model, use_gpu=True, gpu_num=1, num_aux_models=0, split_models=False):
-    if use_gpu:
-        num_devices = min(torch.cuda.device_count(), gpu_num)
-        if num_aux_models > 0 and split_models:
-            num_models = num_aux_models + 1
-            assert num_devices >= num_models
-            assert num_devices % num_models == 0
-
-            num_devices_per_model = num_devices // num_models
-            device_splits = []
-            for model_id in range(num_models):
-                device_splits.append([
-                    model_id * num_devices_per_model + i
-                    for i in range(num_devices_per_model)
-                ])
-
-            main_device_ids = device_splits[0]
-            extra_device_ids = device_splits[1:]
-        else:
-            main_device_ids = list(range(num_devices))
-            extra_device_ids = [main_device_ids for _ in range(num_aux_models)]
+def put_main_model_on_the_device(model, use_gpu=True, gpu_num=1, num_aux_models=0, split_models=False,
+                                 channels_last=False, torch_compile=False, find_unused_parameters=False):
+    if not use_gpu:
+        # do not touch torch.cuda, it initializes CUDA context
+        return model, [None] * num_aux_models
 
-        if num_devices > 1:
-            model = DataParallel(model, device_ids=main_device_ids, output_device=0).cuda(main_device_ids[0])
-        else:
-            model = model.cuda(main_device_ids[0])
+    if channels_last:
+        # NHWC layout lets cuDNN pick Tensor Core kernels, especially with mixed precision
+        model = model.to(memory_format=torch.channels_last)
+
+    assert not (split_models and num_aux_models > 0), \
+        'splitting models between GPUs is not supported, each process keeps all models on its own GPU'
+
+    if is_distributed():
+        # one process per GPU: each rank keeps own replicas of the main and aux models
+        local_rank = torch.cuda.current_device()
+        model = put_on_the_ddp(model, local_rank, torch_compile, find_unused_parameters)
+        extra_device_ids = [[local_rank] for _ in range(num_aux_models)]
     else:
-        extra_device_ids = [None for _ in range(num_aux_models)]
+        assert gpu_num == 1 or torch.cuda.device_count() == 1, \
+            'multi-GPU training requires one process per device, see setup_ddp()'
+
+        model = model.cuda(0)
+        if torch_compile:
+            model = compile_model(model)
+        extra_device_ids = [[0] for _ in range(num_aux_models)]
 
     return model, extra_device_ids
 
 
 def check_classification_classes(model, datamanager, classes, test_only=False):
     def check_classes_consistency(ref_classes, probe_classes, strict=False):
+        # dict key views behave like sets, so no sorting or copying is needed
         if strict:
-            if len(ref_classes) != len(probe_classes):
-                return False
-            return sorted(probe_classes.keys()) == sorted(ref_classes.keys())
-        else:
-            if len(ref_classes) > len(probe_classes):
-                return False
-            probe_names = probe_classes.keys()
-            for cl in ref_classes.keys():
-                if cl not in probe_names:
-                    return False
-        return True
+            return ref_classes.keys() == probe_classes.keys()
+        return ref_classes.keys() <= probe_classes.keys()
 
     classes_map = {v : k for k, v in enumerate(sorted(classes))} if classes else {}
     if test_only:
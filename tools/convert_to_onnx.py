@@ -105,6 +105,9 @@ def main():
         print('End making NNCF changes in model')
 
     model.eval()
+    if hasattr(model, 'fuse') and not is_nncf_used:
+        # fold BN into convolutions to get a single Conv op per block in the graph
+        model.fuse()
 
     transform = build_inference_transform(
         cfg.data.height,
@@ -1,4 +1,5 @@
 import argparse
+import os
 import os.path as osp
 import sys
 import time
@@ -14,7 +15,8 @@ from scripts.script_utils import (build_base_argparser, reset_config,
                                   check_classification_classes,
                                   build_datamanager, build_auxiliary_model,
                                   is_config_parameter_set_from_command_line,
-                                  put_main_model_on_the_device)
+                                  put_main_model_on_the_device, needs_unused_parameters_search,
+                                  setup_ddp, cleanup_ddp, is_main_process, find_free_port)
 
 import torchreid
 from torchreid.engine import build_engine, get_initial_lr_from_checkpoint
@@ -41,13 +43,46 @@ def main():
                         help='Modify aux config options using the command-line')
     args = parser.parse_args()
 
+    # do not query CUDA for CPU and single GPU runs
+    num_devices = min(torch.cuda.device_count(), args.gpu_num) if args.gpu_num > 1 else 1
+    if num_devices > 1:
+        if args.split_models:
+            parser.error('--split-models is not supported with several GPUs: '
+                         'each training process keeps all models on its own GPU')
+
+        cfg = build_config(args)
+        if cfg.lr_finder.enable and not cfg.test.evaluate and not cfg.model.resume:
+            # LR finder runs in a single process, the estimated LR is passed to the training processes
+            lr_finder_args = argparse.Namespace(**vars(args))
+            lr_finder_args.gpu_num = 1
+            lr = main_worker(0, 1, lr_finder_args, lr_finder_only=True)
+            torch.cuda.empty_cache()
+            args.opts = list(args.opts) + ['train.lr', float(lr), 'lr_finder.enable', False]
+
+        # one process per GPU, train.batch_size is the batch size of a single process
+        master_port = os.environ.get('MASTER_PORT') or find_free_port()
+        torch.multiprocessing.spawn(main_worker, nprocs=num_devices, args=(num_devices, args, False, master_port))
+    else:
+        main_worker(0, 1, args)
+
+
+def build_config(args):
     cfg = get_default_config()
-    cfg.use_gpu = torch.cuda.is_available() and args.gpu_num > 0
+    cfg.use_gpu = args.gpu_num > 0 and torch.cuda.is_available()
     if args.config_file:
         merge_from_files_with_base(cfg, args.config_file)
     reset_config(cfg, args)
     cfg.merge_from_list(args.opts)
 
+    return cfg
+
+
+def main_worker(rank, world_size, args, lr_finder_only=False, master_port=None):
+    if world_size > 1:
+        setup_ddp(rank, world_size, master_port)
+
+    cfg = build_config(args)
+
     is_nncf_used = args.nncf or cfg.nncf.enable or is_checkpoint_nncf(cfg.model.load_weights)
     if is_nncf_used:
         print(f'Using NNCF -- making NNCF changes in config')
@@ -60,7 +95,11 @@ def main():
 
     log_name = 'test.log' if cfg.test.evaluate else 'train.log'
     log_name += time.strftime('-%Y-%m-%d-%H-%M-%S')
-    sys.stdout = Logger(osp.join(cfg.data.save_dir, log_name))
+    if is_main_process():
+        sys.stdout = Logger(osp.join(cfg.data.save_dir, log_name))
+    else:
+        # only the main process writes logs and checkpoints
+        cfg.model.save_chkpt = False
 
     print('Show configuration\n{}\n'.format(cfg))
     print('Collecting env info ...')
@@ -114,12 +153,16 @@ def main():
     if cfg.model.classification:
         check_classification_classes(model, datamanager, args.classes, test_only=cfg.test.evaluate)
 
-    model, extra_device_ids = put_main_model_on_the_device(model, cfg.use_gpu, args.gpu_num, num_aux_models, args.split_models)
+    find_unused_parameters = needs_unused_parameters_search(cfg, num_train_classes)
+    model, extra_device_ids = put_main_model_on_the_device(model, cfg.use_gpu, args.gpu_num, num_aux_models,
+                                                           args.split_models, cfg.train.channels_last,
+                                                           cfg.train.torch_compile, find_unused_parameters)
 
     if cfg.lr_finder.enable and not cfg.test.evaluate and not cfg.model.resume:
         if num_aux_models > 0:
             print("Mutual learning is enabled. Learning rate will be estimated for the main model only.")
         assert not is_nncf_used, "lr finder is incompatible with nncf"
+        assert world_size == 1, "lr finder should be run before spawning distributed training processes"
 
         # build  engine for learning rate estimation
         engine = build_engine(cfg, datamanager, model, optimizer, scheduler, initial_lr=aux_lr)
@@ -130,6 +173,8 @@ def main():
         if cfg.lr_finder.stop_after:
             print("Finding learning rate finished. Terminate the training process")
             exit()
+        if lr_finder_only:
+            return aux_lr
 
         # reload all parts of the training
         # we do not check classification parameters
@@ -140,7 +185,9 @@ def main():
         set_random_seed(cfg.train.seed, cfg.train.deterministic)
         datamanager = build_datamanager(cfg, args.classes)
         model = torchreid.models.build_model(**model_kwargs(cfg, num_train_classes))
-        model, _ = put_main_model_on_the_device(model, cfg.use_gpu, args.gpu_num, num_aux_models, args.split_models)
+        model, _ = put_main_model_on_the_device(model, cfg.use_gpu, args.gpu_num, num_aux_models, args.split_models,
+                                                cfg.train.channels_last, cfg.train.torch_compile,
+                                                find_unused_parameters)
         optimizer = torchreid.optim.build_optimizer(model, **optimizer_kwargs(cfg))
         scheduler = torchreid.optim.build_lr_scheduler(optimizer, **lr_scheduler_kwargs(cfg))
 
@@ -167,8 +214,11 @@ def main():
                           initial_lr=aux_lr)
 
     log_dir = cfg.data.tb_log_dir if cfg.data.tb_log_dir else cfg.data.save_dir
+    tb_writer = SummaryWriter(log_dir=log_dir) if is_main_process() else None
     engine.run(**engine_run_kwargs(cfg), compression_ctrl=compression_ctrl,
-               tb_writer=SummaryWriter(log_dir=log_dir))
+               tb_writer=tb_writer)
+
+    cleanup_ddp()
 
 
 if __name__ == '__main__':
@@ -131,6 +131,8 @@ class ImageDataManager(DataManager):
         batch_size_train (int, optional): number of images in a training batch. Default is 32.
         batch_size_test (int, optional): number of images in a test batch. Default is 32.
         workers (int, optional): number of workers. Default is 4.
+        pin_memory (bool, optional): put batches into page-locked memory to copy them
+            to GPU asynchronously. Used only with ``use_gpu``. Default is True.
         batch_num_instances (int, optional): number of instances per identity in a batch.
             Default is 4.
         train_sampler (str, optional): sampler. Default is RandomSampler.
@@ -140,6 +142,11 @@ class ImageDataManager(DataManager):
             Default is False.
         market1501_500k (bool, optional): add 500K distractors to the gallery
             set in market1501. Default is False.
+        num_replicas (int, optional): number of distributed training processes. Each process
+            gets a disjoint shard of the train data. Default is 1.
+        rank (int, optional): rank of the current distributed process. Default is 0.
+        seed (int, optional): random seed to shuffle the train data in the distributed mode.
+            Default is 0.
 
     Examples::
 
@@ -177,6 +184,7 @@ class ImageDataManager(DataManager):
         batch_size_train=32,
         batch_size_test=32,
         workers=4,
+        pin_memory=True,
         train_sampler='RandomSampler',
         batch_num_instances=4,
         epoch_num_instances=-1,
@@ -190,7 +198,10 @@ class ImageDataManager(DataManager):
         apply_masks_to_test=False,
         min_samples_per_id=0,
         num_sampled_packages=1,
-        filter_classes=None
+        filter_classes=None,
+        num_replicas=1,
+        rank=0,
+        seed=0
     ):
 
         super(ImageDataManager, self).__init__(
@@ -204,6 +215,7 @@ class ImageDataManager(DataManager):
             use_gpu=use_gpu,
             apply_masks_to_test=apply_masks_to_test
         )
+        self.pin_memory = self.use_gpu and pin_memory
 
         print('=> Loading train (source) dataset')
         train_dataset_ids_map = self.build_dataset_map(self.source_groups)
@@ -247,12 +259,15 @@ class ImageDataManager(DataManager):
                 batch_num_instances=batch_num_instances,
                 epoch_num_instances=epoch_num_instances,
                 fill_instances=fill_instances,
+                num_replicas=num_replicas,
+                rank=rank,
+                seed=seed
             ),
             batch_size=batch_size_train,
             shuffle=False,
             worker_init_fn=worker_init_fn,
             num_workers=workers,
-            pin_memory=self.use_gpu,
+            pin_memory=self.pin_memory,
             drop_last=True
         )
 
@@ -272,7 +287,7 @@ class ImageDataManager(DataManager):
                     batch_size=batch_size_test,
                     shuffle=False,
                     num_workers=workers,
-                    pin_memory=self.use_gpu,
+                    pin_memory=self.pin_memory,
                     worker_init_fn=worker_init_fn,
                     drop_last=False
                 )
@@ -299,7 +314,7 @@ class ImageDataManager(DataManager):
                     shuffle=False,
                     num_workers=workers,
                     worker_init_fn=worker_init_fn,
-                    pin_memory=self.use_gpu,
+                    pin_memory=self.pin_memory,
                     drop_last=False
                 )
 
@@ -326,7 +341,7 @@ class ImageDataManager(DataManager):
                     worker_init_fn=worker_init_fn,
                     shuffle=False,
                     num_workers=workers,
-                    pin_memory=self.use_gpu,
+                    pin_memory=self.pin_memory,
                     drop_last=False
                 )
 
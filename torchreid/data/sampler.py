@@ -4,6 +4,7 @@ import random
 from collections import defaultdict
 
 import numpy as np
+from torch.utils.data.distributed import DistributedSampler
 from torch.utils.data.sampler import RandomSampler, Sampler, SequentialSampler
 
 AVAI_SAMPLERS = ['RandomIdentitySampler', 'RandomIdentitySamplerV2', 'RandomIdentitySamplerV3',
@@ -11,7 +12,7 @@ AVAI_SAMPLERS = ['RandomIdentitySampler', 'RandomIdentitySamplerV2', 'RandomIden
 
 
 def build_train_sampler(data_source, train_sampler, batch_size=32, batch_num_instances=4,
-                        epoch_num_instances=-1, fill_instances=False, **kwargs):
+                        epoch_num_instances=-1, fill_instances=False, num_replicas=1, rank=0, seed=0, **kwargs):
     """Builds a training sampler.
 
     Args:
@@ -22,6 +23,10 @@ def build_train_sampler(data_source, train_sampler, batch_size=32, batch_num_ins
             batch (when using ``RandomIdentitySampler``). Default is 4.
         epoch_num_instances (int, optional): number of instances per epoch
             (when using ``RandomIdentitySamplerV3``). Default is -1 (auto configuration).
+        num_replicas (int, optional): number of distributed processes. Default is 1.
+        rank (int, optional): rank of the current distributed process. Default is 0.
+        seed (int, optional): random seed shared by distributed processes to shuffle
+            the data consistently. Default is 0.
     """
     assert train_sampler in AVAI_SAMPLERS, \
         'train_sampler must be one of {}, but got {}'.format(AVAI_SAMPLERS, train_sampler)
@@ -33,15 +38,72 @@ def build_train_sampler(data_source, train_sampler, batch_size=32, batch_num_ins
     elif train_sampler == 'RandomIdentitySamplerV3':
         sampler = RandomIdentitySamplerV3(data_source, batch_size, batch_num_instances, epoch_num_instances)
     elif train_sampler == 'SequentialSampler':
+        if num_replicas > 1:
+            return DistributedSampler(data_source, num_replicas=num_replicas, rank=rank, shuffle=False, seed=seed)
         sampler = SequentialSampler(data_source)
     elif train_sampler == 'RandomSampler':
+        if num_replicas > 1:
+            return DistributedSampler(data_source, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
         sampler = RandomSampler(data_source)
     else:
         raise ValueError('Unknown sampler: {}'.format(train_sampler))
 
+    if num_replicas > 1:
+        sampler = DistributedSamplerWrapper(sampler, batch_size, num_replicas, rank, seed)
+
     return sampler
 
 
+class DistributedSamplerWrapper(Sampler):
+    """Splits the output of a batch-structured sampler between distributed processes.
+
+    Identity samplers arrange indices into groups of instances inside each batch,
+    so the stream is sharded by whole batches instead of by single indices.
+    Each process draws the stream from the same seed to get disjoint shards.
+
+    Args:
+        sampler (Sampler): base sampler.
+        batch_size (int): batch size of a single process.
+        num_replicas (int): number of distributed processes.
+        rank (int): rank of the current process.
+        seed (int, optional): base random seed shared by all processes. Default is 0.
+    """
+
+    def __init__(self, sampler, batch_size, num_replicas, rank, seed=0):
+        assert 0 <= rank < num_replicas
+
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        num_batches = len(self.sampler) // (self.batch_size * self.num_replicas)
+        self.length = num_batches * self.batch_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        py_state, np_state = random.getstate(), np.random.get_state()
+        random.seed(self.seed + self.epoch)
+        np.random.seed(self.seed + self.epoch)
+        indices = list(self.sampler)
+        random.setstate(py_state)
+        np.random.set_state(np_state)
+
+        num_batches = len(indices) // (self.batch_size * self.num_replicas)
+        out_indices = []
+        for batch_id in range(self.rank, num_batches * self.num_replicas, self.num_replicas):
+            out_indices.extend(indices[batch_id * self.batch_size:(batch_id + 1) * self.batch_size])
+
+        return iter(out_indices)
+
+    def __len__(self):
+        return self.length
+
+
 class RandomIdentitySampler(Sampler):
     """Randomly samples N identities each with K instances.
 
@@ -10,6 +10,9 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler,
         if cfg.loss.name not in ['softmax', 'am_softmax']:
             raise NotImplementedError('Freezing of aux models or NNCF compression are supported only for '
                                       'softmax and am_softmax losses for data.type = image')
+    if cfg.train.mix_precision or cfg.train.channels_last:
+        assert cfg.loss.name in ['softmax', 'am_softmax'], \
+            'Mixed precision and channels_last training are supported only for softmax and am_softmax losses'
     initial_lr = initial_lr if initial_lr else cfg.train.lr
     if cfg.loss.name in ['softmax', 'am_softmax']:
         softmax_type = 'stock' if cfg.loss.name == 'softmax' else 'am'
@@ -56,7 +59,9 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler,
             nncf_metainfo=nncf_metainfo,
             initial_lr=initial_lr,
             use_ema_decay=cfg.train.ema.enable,
-            ema_decay=cfg.train.ema.ema_decay
+            ema_decay=cfg.train.ema.ema_decay,
+            mix_precision=cfg.train.mix_precision,
+            channels_last=cfg.train.channels_last
         )
     elif cfg.loss.name == 'contrastive':
         engine = ImageContrastiveEngine(
@@ -10,6 +10,7 @@ import optuna
 
 import numpy as np
 import torch
+import torch.distributed as dist
 from torch.nn import functional as F
 
 from torchreid.optim import ReduceLROnPlateauV2, WarmupScheduler
@@ -62,7 +63,9 @@ class Engine:
                  epoch_interval_for_turn_off_mutual_learning=None,
                  use_ema_decay=False,
                  ema_decay=0.999,
-                 seed=5):
+                 seed=5,
+                 mix_precision=False,
+                 channels_last=False):
 
         self.datamanager = datamanager
         self.train_loader = self.datamanager.train_loader
@@ -96,6 +99,9 @@ class Engine:
         self.epoch_interval_for_turn_off_mutual_learning = epoch_interval_for_turn_off_mutual_learning
         self.model_names_to_freeze = []
         self.current_lr = None
+        self.mix_precision = self.use_gpu and mix_precision
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.mix_precision)
+        self.channels_last = channels_last
 
         if isinstance(models, (tuple, list)):
             assert isinstance(optimizers, (tuple, list))
@@ -328,6 +334,9 @@ class Engine:
             raise ValueError('visrank can be set to True only if test_only=True')
 
         if test_only:
+            if not self._is_main_process():
+                return None
+
             test_results = self.test(
                                      0,
                                      dist_metric=dist_metric,
@@ -342,7 +351,7 @@ class Engine:
                                     )
             return test_results
 
-        if not lr_finder:
+        if not lr_finder and self._is_main_process():
             print('Test before training')
             self.test(
                       0,
@@ -397,17 +406,20 @@ class Engine:
                and (self.epoch + 1) != self.max_epoch)
                or self.epoch == (self.max_epoch - 1)):
 
-                top1, top5, mAP, should_save_ema_model = self.test(
-                    self.epoch,
-                    dist_metric=dist_metric,
-                    normalize_feature=normalize_feature,
-                    visrank=visrank,
-                    visrank_topk=visrank_topk,
-                    save_dir=save_dir,
-                    use_metric_cuhk03=use_metric_cuhk03,
-                    ranks=ranks,
-                    lr_finder=lr_finder,
-                )
+                # only the main process evaluates, the decisions below are shared with other ranks
+                top1, top5, mAP, should_save_ema_model = 0.0, 0.0, 0.0, False
+                if self._is_main_process():
+                    top1, top5, mAP, should_save_ema_model = self.test(
+                        self.epoch,
+                        dist_metric=dist_metric,
+                        normalize_feature=normalize_feature,
+                        visrank=visrank,
+                        visrank_topk=visrank_topk,
+                        save_dir=save_dir,
+                        use_metric_cuhk03=use_metric_cuhk03,
+                        ranks=ranks,
+                        lr_finder=lr_finder,
+                    )
 
                 if lr_finder:
                     print(f"epoch: {self.epoch}\t top1: {top1}\t lr: {self.get_current_lr()}")
@@ -419,7 +431,11 @@ class Engine:
                             raise optuna.exceptions.TrialPruned()
 
                 if not lr_finder:
-                    should_exit, is_candidate_for_best = self.exit_on_plateau_and_choose_best(top1, top5, mAP)
+                    should_exit, is_candidate_for_best = False, False
+                    if self._is_main_process():
+                        should_exit, is_candidate_for_best = self.exit_on_plateau_and_choose_best(top1, top5, mAP)
+                    should_exit, is_candidate_for_best = self._broadcast_from_main_process(should_exit,
+                                                                                          is_candidate_for_best)
                     should_exit = self.early_stoping and should_exit
 
                     if self.save_chkpt:
@@ -504,6 +520,10 @@ class Engine:
         if self._should_freeze_aux_models(self.epoch):
             self._freeze_aux_models()
 
+        if hasattr(self.train_loader.sampler, 'set_epoch'):
+            # reshuffle shards of distributed samplers every epoch
+            self.train_loader.sampler.set_epoch(self.epoch)
+
         self.num_batches = len(self.train_loader)
         end = time.time()
         for self.batch_idx, data in enumerate(self.train_loader):
@@ -564,7 +584,36 @@ class Engine:
                 self.ema_model.update(self.models[self.main_model_name])
 
         if not lr_finder:
-            self.update_lr(output_avg_metric = losses.meters['loss'].avg)
+            # every rank has to step the plateau schedulers with the same value to keep the same LR
+            self.update_lr(output_avg_metric = self._average_across_processes(losses.meters['loss'].avg))
+
+    @staticmethod
+    def _is_distributed():
+        return dist.is_available() and dist.is_initialized()
+
+    @staticmethod
+    def _is_main_process():
+        return not Engine._is_distributed() or dist.get_rank() == 0
+
+    @staticmethod
+    def _broadcast_from_main_process(*flags):
+        if not Engine._is_distributed():
+            return flags
+
+        values = torch.tensor(flags, dtype=torch.uint8, device=torch.cuda.current_device())
+        dist.broadcast(values, src=0)
+
+        return tuple(bool(v) for v in values.tolist())
+
+    @staticmethod
+    def _average_across_processes(value):
+        if not Engine._is_distributed():
+            return value
+
+        value = torch.tensor(value, dtype=torch.float64, device=torch.cuda.current_device())
+        dist.all_reduce(value)
+
+        return value.item() / dist.get_world_size()
 
     def forward_backward(self, data):
         raise NotImplementedError
@@ -608,6 +657,9 @@ class Engine:
             domain = 'source' if dataset_name in self.datamanager.sources else 'target'
             print('##### Evaluating {} ({}) #####'.format(dataset_name, domain))
             for model_id, (model_name, model) in enumerate(self.models.items()):
+                if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+                    # DDP forward syncs buffers with other ranks, while only the main process evaluates
+                    model = model.module
                 if get_model_attr(model, 'classification'):
                     # do not evaluate second model till last epoch
                     if (model_name != self.main_model_name
@@ -743,7 +795,7 @@ class Engine:
             for _, data in enumerate(data_loader):
                 imgs, pids, camids = self.parse_data_for_eval(data)
                 if self.use_gpu:
-                    imgs = imgs.cuda()
+                    imgs = imgs.cuda(non_blocking=True)
 
                 features = model(imgs),
                 features = features.data.cpu()
@@ -820,18 +872,18 @@ class Engine:
 
         obj_ids = data[1]
         if use_gpu:
-            imgs = imgs.cuda()
-            obj_ids = obj_ids.cuda()
+            imgs = imgs.cuda(non_blocking=True)
+            obj_ids = obj_ids.cuda(non_blocking=True)
 
         if output_dict:
             if len(data) > 3:
-                dataset_ids = data[3].cuda() if use_gpu else data[3]
+                dataset_ids = data[3].cuda(non_blocking=True) if use_gpu else data[3]
 
                 masks = None
                 if enable_masks:
-                    masks = data[4].cuda() if use_gpu else data[4]
+                    masks = data[4].cuda(non_blocking=True) if use_gpu else data[4]
 
-                attr = [record.cuda() if use_gpu else record for record in data[5:]]
+                attr = [record.cuda(non_blocking=True) if use_gpu else record for record in data[5:]]
                 if len(attr) == 0:
                     attr = None
             else:
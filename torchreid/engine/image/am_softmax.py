@@ -23,6 +23,7 @@ import copy
 
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 from torchreid import metrics
@@ -43,7 +44,8 @@ class ImageAMSoftmaxEngine(Engine):
                  reformulate=False, aug_prob=1., conf_penalty=False, pr_product=False, m=0.35, s=10, compute_s=False, end_s=None,
                  duration_s=None, skip_steps_s=None, enable_masks=False, adaptive_margins=False, class_weighting=False,
                  attr_cfg=None, base_num_classes=-1, symmetric_ce=False, mix_weight=1.0, enable_rsc=False, enable_sam=False,
-                 should_freeze_aux_models=False, nncf_metainfo=None, initial_lr=None, use_ema_decay=False, ema_decay=0.999):
+                 should_freeze_aux_models=False, nncf_metainfo=None, initial_lr=None, use_ema_decay=False, ema_decay=0.999,
+                 mix_precision=False, channels_last=False):
         super(ImageAMSoftmaxEngine, self).__init__(datamanager,
                                                    models=models,
                                                    optimizers=optimizers,
@@ -57,7 +59,9 @@ class ImageAMSoftmaxEngine(Engine):
                                                    nncf_metainfo=nncf_metainfo,
                                                    initial_lr=initial_lr,
                                                    use_ema_decay=use_ema_decay,
-                                                   ema_decay=ema_decay)
+                                                   ema_decay=ema_decay,
+                                                   mix_precision=mix_precision,
+                                                   channels_last=channels_last)
 
         assert softmax_type in ['stock', 'am']
         assert s > 0.0
@@ -66,10 +70,18 @@ class ImageAMSoftmaxEngine(Engine):
 
         self.regularizer = get_regularizer(reg_cfg)
         self.enable_metric_losses = metric_cfg.enable
+        # centers and balancing weights of metric losses are outside of DDP and would diverge between ranks
+        assert not (self.enable_metric_losses and dist.is_available() and dist.is_initialized()), \
+            'Metric losses are not supported in the distributed mode'
         self.enable_masks = enable_masks
         self.mix_weight = mix_weight
         self.enable_rsc = enable_rsc
         self.enable_sam = enable_sam
+        assert not (self.enable_sam and self.mix_precision), \
+            'SAM optimizer is not supported with mixed precision training'
+        # metric losses step their own optimizers on gradients that are not unscaled by GradScaler
+        assert not (self.enable_metric_losses and self.mix_precision), \
+            'Metric losses are not supported with mixed precision training'
         self.aug_type = aug_type
         self.aug_prob = aug_prob
         self.aug_index = None
@@ -206,6 +218,8 @@ class ImageAMSoftmaxEngine(Engine):
             train_records['dataset_id'] = train_records['dataset_id'].view(-1, 1).repeat(1, num_packages).view(-1)
 
         imgs, obj_ids = self._apply_batch_augmentation(imgs, obj_ids)
+        if self.channels_last:
+            imgs = imgs.contiguous(memory_format=torch.channels_last)
 
         model_names = self.get_model_names()
         num_models = len(model_names)
@@ -219,46 +233,46 @@ class ImageAMSoftmaxEngine(Engine):
             total_loss = torch.zeros([], dtype=imgs.dtype, device=imgs.device)
             loss_summary = dict()
 
-            for model_name in model_names:
-                self.optims[model_name].zero_grad()
-
-                model_loss, model_loss_summary, model_avg_acc, model_logits = self._single_model_losses(
-                    self.models[model_name], train_records, imgs, obj_ids, n_iter, model_name, num_packages
-                )
+            with torch.cuda.amp.autocast(enabled=self.mix_precision):
+                for model_name in model_names:
+                    self.optims[model_name].zero_grad()
 
-                avg_acc += model_avg_acc / float(num_models)
-                total_loss += model_loss / float(num_models)
-                loss_summary.update(model_loss_summary)
+                    model_loss, model_loss_summary, model_avg_acc, model_logits = self._single_model_losses(
+                        self.models[model_name], train_records, imgs, obj_ids, n_iter, model_name, num_packages
+                    )
 
-                for trg_id in range(self.num_targets):
-                    if model_logits[trg_id] is not None:
-                        out_logits[trg_id].append(model_logits[trg_id])
+                    avg_acc += model_avg_acc / float(num_models)
+                    total_loss += model_loss / float(num_models)
+                    loss_summary.update(model_loss_summary)
 
-            if len(model_names) > 1:
-                num_mutual_losses = 0
-                mutual_loss = torch.zeros([], dtype=imgs.dtype, device=imgs.device)
-                for trg_id in range(self.num_targets):
-                    if len(out_logits[trg_id]) <= 1:
-                        continue
+                    for trg_id in range(self.num_targets):
+                        if model_logits[trg_id] is not None:
+                            out_logits[trg_id].append(model_logits[trg_id])
 
-                    with torch.no_grad():
-                        trg_probs = torch.softmax(torch.stack(out_logits[trg_id]), dim=2).mean(dim=0)
+                if len(model_names) > 1:
+                    num_mutual_losses = 0
+                    mutual_loss = torch.zeros([], dtype=imgs.dtype, device=imgs.device)
+                    for trg_id in range(self.num_targets):
+                        if len(out_logits[trg_id]) <= 1:
+                            continue
 
-                    for model_id, logits in enumerate(out_logits[trg_id]):
-                        log_probs = torch.log_softmax(logits, dim=1)
-                        m_loss = (trg_probs * log_probs).sum(dim=1).mean().neg()
+                        with torch.no_grad():
+                            trg_probs = torch.softmax(torch.stack(out_logits[trg_id]), dim=2).mean(dim=0)
 
-                        mutual_loss += m_loss
-                        loss_summary['mutual_{}/{}'.format(trg_id, model_names[model_id])] = m_loss.item()
-                        num_mutual_losses += 1
+                        for model_id, logits in enumerate(out_logits[trg_id]):
+                            log_probs = torch.log_softmax(logits, dim=1)
+                            m_loss = (trg_probs * log_probs).sum(dim=1).mean().neg()
 
-                should_turn_off_mutual_learning = self._should_turn_off_mutual_learning(self.epoch)
-                coeff_mutual_learning = int(not should_turn_off_mutual_learning)
+                            mutual_loss += m_loss
+                            loss_summary['mutual_{}/{}'.format(trg_id, model_names[model_id])] = m_loss.item()
+                            num_mutual_losses += 1
 
-                total_loss += coeff_mutual_learning * mutual_loss / float(num_mutual_losses)
+                    should_turn_off_mutual_learning = self._should_turn_off_mutual_learning(self.epoch)
+                    coeff_mutual_learning = int(not should_turn_off_mutual_learning)
 
+                    total_loss += coeff_mutual_learning * mutual_loss / float(num_mutual_losses)
 
-            total_loss.backward(retain_graph=self.enable_metric_losses)
+            self.scaler.scale(total_loss).backward(retain_graph=self.enable_metric_losses)
 
             for model_name in model_names:
                 for trg_id in range(self.num_targets):
@@ -270,7 +284,8 @@ class ImageAMSoftmaxEngine(Engine):
                 elif isinstance(self.optims[model_name], SAM) and step == 2:
                     self.optims[model_name].second_step()
                 elif not isinstance(self.optims[model_name], SAM) and step == 1:
-                    self.optims[model_name].step()
+                    self.scaler.step(self.optims[model_name])
+            self.scaler.update()
 
             loss_summary['loss'] = total_loss.item()
 
@@ -153,8 +153,8 @@ class ImageContrastiveEngine(Engine):
         assert len(imgs.size()) == 5
 
         if use_gpu:
-            imgs = imgs.cuda()
-            dataset_ids = dataset_ids.cuda()
+            imgs = imgs.cuda(non_blocking=True)
+            dataset_ids = dataset_ids.cuda(non_blocking=True)
 
         b, num_packages, c, h, w = imgs.size()
         assert num_packages == 2
@@ -75,8 +75,8 @@ class ImageSoftmaxEngine(Engine):
     def forward_backward(self, data):
         imgs, pids = self.parse_data_for_train(data)
         if self.use_gpu:
-            imgs = imgs.cuda()
-            pids = pids.cuda()
+            imgs = imgs.cuda(non_blocking=True)
+            pids = pids.cuda(non_blocking=True)
 
         model_names = self.get_model_names()
         num_models = len(model_names)
@@ -92,8 +92,8 @@ class ImageTripletEngine(Engine):
         imgs, pids = self.parse_data_for_train(data)
 
         if self.use_gpu:
-            imgs = imgs.cuda()
-            pids = pids.cuda()
+            imgs = imgs.cuda(non_blocking=True)
+            pids = pids.cuda(non_blocking=True)
 
         outputs, features = self.model(imgs)
         loss_t = self.compute_loss(self.criterion_t, features, pids)
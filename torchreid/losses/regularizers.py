@@ -152,7 +152,7 @@ class NormRegularizer(nn.Module):
                     weight=m.weight,
                     updated=False,
                 ))
-            elif isinstance(m, nn.BatchNorm2d):
+            elif isinstance(m, (nn.BatchNorm2d, nn.SyncBatchNorm)):
                 assert len(conv_layers) > 0
 
                 last_conv = conv_layers[-1]
@@ -12,7 +12,7 @@ def score_extraction(data_loader, model, use_gpu, labelmap=[], head_id=0):
         for batch_idx, data in enumerate(data_loader):
             batch_images, batch_labels = data[0], data[1]
             if use_gpu:
-                batch_images = batch_images.cuda()
+                batch_images = batch_images.cuda(non_blocking=True)
 
             if labelmap:
                 for i, label in enumerate(labelmap):
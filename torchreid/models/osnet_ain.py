@@ -5,10 +5,12 @@ from collections import OrderedDict
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 from torchreid.losses import AngleSimpleLinear
 from torchreid.ops import (Dropout, GumbelSigmoid, HSwish,
                            LocalContrastNormalization)
+from torchreid.utils.torchtools import squeeze_to_size
 from .common import ModelInterface
 
 __all__ = ['osnet_ain_x1_0', 'osnet_ain2_x1_0']
@@ -22,6 +24,36 @@ pretrained_urls = {
 # Basic layers
 ##########
 
+def fuse_conv_bn(conv, bn):
+    """Folds BN into the preceding convolution. Other normalizations are kept as is."""
+    if not isinstance(bn, nn.BatchNorm2d):
+        return conv, bn
+
+    return fuse_conv_bn_eval(conv, bn), nn.Identity()
+
+
+def fuse_linear_bn(linear, bn):
+    """Folds BatchNorm1d into the preceding linear layer."""
+    assert not (linear.training or bn.training), 'Fusion only for eval!'
+
+    fused_linear = nn.Linear(linear.in_features, linear.out_features, bias=True)
+    fused_linear.to(device=linear.weight.device, dtype=linear.weight.dtype)
+
+    scale = bn.running_var.add(bn.eps).rsqrt()
+    if bn.affine:
+        scale = scale * bn.weight
+    bias = linear.bias if linear.bias is not None else torch.zeros_like(bn.running_mean)
+    shift = (bias - bn.running_mean) * scale
+    if bn.affine:
+        shift = shift + bn.bias
+
+    fused_linear.weight = nn.Parameter(linear.weight * scale.unsqueeze(1)).requires_grad_(linear.weight.requires_grad)
+    fused_linear.bias = nn.Parameter(shift).requires_grad_(linear.weight.requires_grad)
+    fused_linear.eval()
+
+    return fused_linear, nn.Identity()
+
+
 class ConvLayer(nn.Module):
     """Convolution layer (conv + bn + relu)."""
 
@@ -50,18 +82,20 @@ class ConvLayer(nn.Module):
             self.bn = nn.InstanceNorm2d(out_channels, affine=True)
         else:
             self.bn = nn.BatchNorm2d(out_channels)
-        self.relu = nn.ReLU()
 
     def forward(self, x):
         x = self.conv(x)
         x = self.bn(x)
-        return self.relu(x)
+        return F.relu(x, inplace=True)
+
+    def fuse(self):
+        self.conv, self.bn = fuse_conv_bn(self.conv, self.bn)
 
 
 class Conv1x1(nn.Module):
     """1x1 convolution + bn + relu."""
 
-    def __init__(self, in_channels, out_channels, stride=1, groups=1, out_fn=nn.ReLU, use_in=False):
+    def __init__(self, in_channels, out_channels, stride=1, groups=1, use_relu=True, use_in=False):
         super(Conv1x1, self).__init__()
 
         self.conv = nn.Conv2d(
@@ -74,13 +108,15 @@ class Conv1x1(nn.Module):
             groups=groups
         )
         self.bn = nn.InstanceNorm2d(out_channels, affine=True) if use_in else nn.BatchNorm2d(out_channels)
-        self.out_fn = out_fn() if out_fn is not None else None
+        self.use_relu = use_relu
 
     def forward(self, x):
         y = self.conv(x)
         y = self.bn(y)
-        y = self.out_fn(y) if self.out_fn is not None else y
-        return y
+        return F.relu(y, inplace=True) if self.use_relu else y
+
+    def fuse(self):
+        self.conv, self.bn = fuse_conv_bn(self.conv, self.bn)
 
 
 class Conv1x1Linear(nn.Module):
@@ -101,11 +137,15 @@ class Conv1x1Linear(nn.Module):
             x = self.bn(x)
         return x
 
+    def fuse(self):
+        if self.bn is not None:
+            self.conv, self.bn = fuse_conv_bn(self.conv, self.bn)
+
 
 class Conv3x3(nn.Module):
     """3x3 convolution + bn + relu."""
 
-    def __init__(self, in_channels, out_channels, stride=1, groups=1, out_fn=nn.ReLU):
+    def __init__(self, in_channels, out_channels, stride=1, groups=1, use_relu=True):
         super(Conv3x3, self).__init__()
         self.conv = nn.Conv2d(
             in_channels,
@@ -117,13 +157,15 @@ class Conv3x3(nn.Module):
             groups=groups
         )
         self.bn = nn.BatchNorm2d(out_channels)
-        self.out_fn = out_fn() if out_fn is not None else None
+        self.use_relu = use_relu
 
     def forward(self, x):
         y = self.conv(x)
         y = self.bn(y)
-        y = self.out_fn(y) if self.out_fn is not None else y
-        return y
+        return F.relu(y, inplace=True) if self.use_relu else y
+
+    def fuse(self):
+        self.conv, self.bn = fuse_conv_bn(self.conv, self.bn)
 
 
 class LightConv3x3(nn.Module):
@@ -147,13 +189,15 @@ class LightConv3x3(nn.Module):
             groups=out_channels
         )
         self.bn = nn.BatchNorm2d(out_channels)
-        self.relu = nn.ReLU()
 
     def forward(self, x):
         x = self.conv1(x)
         x = self.conv2(x)
         x = self.bn(x)
-        return self.relu(x)
+        return F.relu(x, inplace=True)
+
+    def fuse(self):
+        self.conv2, self.bn = fuse_conv_bn(self.conv2, self.bn)
 
 
 class LightConvStream(nn.Module):
@@ -174,6 +218,139 @@ class LightConvStream(nn.Module):
         return self.layers(x)
 
 
+class LightConvStreams(nn.ModuleList):
+    """Lightweight convolution streams of depth 1..T over the same input.
+
+    In the eval mode the streams are computed level by level: every level
+    runs a single grouped convolution over all streams that are deep enough.
+    Stacked weights (with BN folded into the depthwise convolution) are built
+    lazily and rebuilt once any of the source tensors is changed in-place.
+    """
+
+    def __init__(self, in_channels, out_channels, num_streams):
+        super(LightConvStreams, self).__init__()
+        assert num_streams >= 1
+
+        self.out_channels = out_channels
+        for t in range(1, num_streams + 1):
+            self.append(LightConvStream(in_channels, out_channels, t))
+
+        self.reset_grouped_params()
+
+    def _is_groupable(self):
+        for stream in self:
+            for layer in stream.layers:
+                if type(layer.conv1) is not nn.Conv2d or type(layer.conv2) is not nn.Conv2d:
+                    return False
+                if not isinstance(layer.bn, (nn.BatchNorm2d, nn.SyncBatchNorm, nn.Identity)):
+                    return False
+
+        return True
+
+    @staticmethod
+    def _source_tensors(layer):
+        tensors = [layer.conv1.weight, layer.conv2.weight]
+        if layer.conv2.bias is not None:
+            tensors.append(layer.conv2.bias)
+        if not isinstance(layer.bn, nn.Identity):
+            tensors += [layer.bn.running_mean, layer.bn.running_var]
+            if layer.bn.affine:
+                tensors += [layer.bn.weight, layer.bn.bias]
+
+        return tensors
+
+    @staticmethod
+    def _fold_bn(conv, bn):
+        weight = conv.weight
+        bias = conv.bias if conv.bias is not None else weight.new_zeros(weight.size(0))
+        if isinstance(bn, nn.Identity):
+            return weight, bias
+
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        if bn.affine:
+            scale = scale * bn.weight
+        shift = -bn.running_mean * scale
+        if bn.affine:
+            shift = shift + bn.bias
+
+        return weight * scale.view(-1, 1, 1, 1), bias * scale + shift
+
+    def reset_grouped_params(self):
+        self._grouped_params = None
+        self._grouped_sources = []
+        self._grouped_versions = []
+
+    def _build_grouped_params(self):
+        self.reset_grouped_params()
+        if not self._is_groupable():
+            # the per-stream path is used, nothing to track
+            self._grouped_params = []
+            return
+
+        grouped_params = []
+        with torch.no_grad():
+            for level in range(len(self)):
+                layers = [stream.layers[level] for stream in self[level:]]
+                conv2_params = [self._fold_bn(layer.conv2, layer.bn) for layer in layers]
+
+                grouped_params.append((
+                    torch.cat([layer.conv1.weight for layer in layers]),
+                    torch.cat([weight for weight, _ in conv2_params]),
+                    torch.cat([bias for _, bias in conv2_params])
+                ))
+
+        self._grouped_params = grouped_params
+        self._grouped_sources = [t for stream in self for layer in stream.layers for t in self._source_tensors(layer)]
+        self._grouped_versions = [t._version for t in self._grouped_sources]
+
+    def _grouped_params_are_stale(self):
+        # in-place updates (load_state_dict, EMA, optimizer steps) bump the version counters
+        return self._grouped_params is None or \
+            self._grouped_versions != [t._version for t in self._grouped_sources]
+
+    def train(self, mode=True):
+        super(LightConvStreams, self).train(mode)
+        self.reset_grouped_params()
+
+        return self
+
+    def _apply(self, fn):
+        super(LightConvStreams, self)._apply(fn)
+        # the tensors can be replaced w/o bumping their versions, e.g. by .to() or .half()
+        self.reset_grouped_params()
+
+        return self
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super(LightConvStreams, self)._load_from_state_dict(*args, **kwargs)
+        self.reset_grouped_params()
+
+    def _grouped_forward(self, x):
+        outputs = []
+        y = x
+        for level, (conv1_weight, conv2_weight, conv2_bias) in enumerate(self._grouped_params):
+            y = F.conv2d(y, conv1_weight, groups=1 if level == 0 else len(self) - level)
+            y = F.conv2d(y, conv2_weight, conv2_bias, padding=1, groups=conv2_weight.size(0))
+            y = F.relu(y, inplace=True)
+
+            # the shallowest active stream is finished on the current level
+            outputs.append(y[:, :self.out_channels])
+            y = y[:, self.out_channels:]
+
+        return outputs
+
+    def forward(self, x):
+        if self.training:
+            return [stream(x) for stream in self]
+
+        if self._grouped_params_are_stale():
+            self._build_grouped_params()
+        if not self._grouped_params:
+            return [stream(x) for stream in self]
+
+        return self._grouped_forward(x)
+
+
 ##########
 # Attention modules
 ##########
@@ -186,17 +363,20 @@ class ResidualAttention(nn.Module):
 
         internal_channels = int(in_channels / reduction)
         self.spatial_attention = nn.Sequential(
-            Conv1x1(in_channels, internal_channels, out_fn=None),
+            Conv1x1(in_channels, internal_channels, use_relu=False),
             HSwish(),
-            Conv3x3(internal_channels, internal_channels, groups=internal_channels, out_fn=None),
+            Conv3x3(internal_channels, internal_channels, groups=internal_channels, use_relu=False),
             HSwish(),
-            Conv1x1(internal_channels, 1, out_fn=None),
-            GumbelSigmoid(scale=5.0) if gumbel else nn.Sigmoid()
+            Conv1x1(internal_channels, 1, use_relu=False)
         )
 
+        # parameter-free, so state_dict keys are the same as with the activation inside spatial_attention
+        self._mask_fn = GumbelSigmoid(scale=5.0) if gumbel else torch.sigmoid
+
     def forward(self, x, return_mask=False):
-        soft_mask = self.spatial_attention(x)
-        out = (1.0 + soft_mask) * x if self.residual else soft_mask * x
+        soft_mask = self._mask_fn(self.spatial_attention(x))
+        # x + mask * x in a single kernel, w/o temporary (1 + mask) tensor
+        out = torch.addcmul(x, soft_mask, x) if self.residual else soft_mask * x
 
         if return_mask:
             return out, soft_mask
@@ -234,7 +414,6 @@ class LCTGate(nn.Module):
         assert groups > 0
         self.gn = nn.GroupNorm(groups, channels, affine=True)
 
-        self.global_avgpool = nn.AdaptiveAvgPool2d(1)
         self.gate_activation = nn.Sigmoid()
 
     def init_params(self):
@@ -242,7 +421,7 @@ class LCTGate(nn.Module):
         nn.init.ones_(self.gn.bias)
 
     def forward(self, x):
-        y = self.global_avgpool(x)
+        y = x.mean(dim=(2, 3), keepdim=True)
         y = self.gn(y)
         y = self.gate_activation(y)
         out = y * x
@@ -266,25 +445,11 @@ class ChannelGate(nn.Module):
         if num_gates is None:
             num_gates = in_channels
         self.return_gates = return_gates
-        self.global_avgpool = nn.AdaptiveAvgPool2d(1)
-        self.fc1 = nn.Conv2d(
-            in_channels,
-            in_channels // reduction,
-            kernel_size=1,
-            bias=True,
-            padding=0
-        )
+        self.fc1 = nn.Linear(in_channels, in_channels // reduction, bias=True)
         self.norm1 = None
         if layer_norm:
-            self.norm1 = nn.LayerNorm((in_channels // reduction, 1, 1))
-        self.relu = nn.ReLU()
-        self.fc2 = nn.Conv2d(
-            in_channels // reduction,
-            num_gates,
-            kernel_size=1,
-            bias=True,
-            padding=0
-        )
+            self.norm1 = nn.LayerNorm(in_channels // reduction)
+        self.fc2 = nn.Linear(in_channels // reduction, num_gates, bias=True)
         if gate_activation == 'sigmoid':
             self.gate_activation = nn.Sigmoid()
         elif gate_activation == 'relu':
@@ -294,16 +459,23 @@ class ChannelGate(nn.Module):
         else:
             raise RuntimeError("Unknown gate activation: {}".format(gate_activation))
 
+    def init_params(self):
+        # the same init as for the 1x1 convolutions used before
+        for fc in [self.fc1, self.fc2]:
+            nn.init.kaiming_normal_(fc.weight, mode='fan_out', nonlinearity='relu')
+            nn.init.constant_(fc.bias, 0)
+
     def forward(self, x):
         input = x
-        x = self.global_avgpool(x)
+        x = x.mean(dim=(2, 3))
         x = self.fc1(x)
         if self.norm1 is not None:
             x = self.norm1(x)
-        x = self.relu(x)
+        x = F.relu(x, inplace=True)
         x = self.fc2(x)
         if self.gate_activation is not None:
             x = self.gate_activation(x)
+        x = x[:, :, None, None]
         if self.return_gates:
             return x
         return input * x
@@ -319,9 +491,7 @@ class OSBlock(nn.Module):
         mid_channels = out_channels // reduction
 
         self.conv1 = Conv1x1(in_channels, mid_channels)
-        self.conv2 = nn.ModuleList()
-        for t in range(1, T + 1):
-            self.conv2 += [LightConvStream(mid_channels, mid_channels, t)]
+        self.conv2 = LightConvStreams(mid_channels, mid_channels, T)
         self.gate = channel_gate(mid_channels)
         self.conv3 = Conv1x1Linear(mid_channels, out_channels)
 
@@ -340,18 +510,17 @@ class OSBlock(nn.Module):
 
         x1 = self.conv1(x)
 
-        x2 = 0
-        for conv2_t in self.conv2:
-            x2_t = conv2_t(x1)
-            x2 = x2 + self.gate(x2_t)
+        gates = [self.gate(x2_t) for x2_t in self.conv2(x1)]
+        x2 = torch.stack(gates, dim=0).sum(dim=0)
 
         x3 = self.conv3(x2)
         if self.dropout is not None:
             x3 = self.dropout(x3, x)
 
-        out = x3 + identity
+        # conv3, IN and dropout do not keep their outputs for backward, so x3 can be reused in-place
+        x3.add_(identity)
 
-        return F.relu(out)
+        return F.relu(x3, inplace=True)
 
 
 class OSBlockINin(nn.Module):
@@ -364,9 +533,7 @@ class OSBlockINin(nn.Module):
         mid_channels = out_channels // reduction
 
         self.conv1 = Conv1x1(in_channels, mid_channels)
-        self.conv2 = nn.ModuleList()
-        for t in range(1, T + 1):
-            self.conv2 += [LightConvStream(mid_channels, mid_channels, t)]
+        self.conv2 = LightConvStreams(mid_channels, mid_channels, T)
         self.gate = channel_gate(mid_channels)
         self.conv3 = Conv1x1Linear(mid_channels, out_channels, bn=False)
 
@@ -387,19 +554,18 @@ class OSBlockINin(nn.Module):
 
         x1 = self.conv1(x)
 
-        x2 = 0
-        for conv2_t in self.conv2:
-            x2_t = conv2_t(x1)
-            x2 = x2 + self.gate(x2_t)
+        gates = [self.gate(x2_t) for x2_t in self.conv2(x1)]
+        x2 = torch.stack(gates, dim=0).sum(dim=0)
 
         x3 = self.conv3(x2)
         x3 = self.IN(x3)  # IN inside residual
         if self.dropout is not None:
             x3 = self.dropout(x3, x)
 
-        out = x3 + identity
+        # conv3, IN and dropout do not keep their outputs for backward, so x3 can be reused in-place
+        x3.add_(identity)
 
-        return F.relu(out)
+        return F.relu(x3, inplace=True)
 
 
 ##########
@@ -546,11 +712,11 @@ class OSNet(ModelInterface):
         internal_num_channels = int(float(num_channels) / float(channel_factor))
 
         layers = [
-            Conv1x1(num_channels, internal_num_channels, out_fn=None),
+            Conv1x1(num_channels, internal_num_channels, use_relu=False),
             HSwish(),
-            Conv3x3(internal_num_channels, internal_num_channels, groups=internal_num_channels, out_fn=None),
+            Conv3x3(internal_num_channels, internal_num_channels, groups=internal_num_channels, use_relu=False),
             HSwish(),
-            Conv1x1(internal_num_channels, 1, out_fn=None),
+            Conv1x1(internal_num_channels, 1, use_relu=False),
             GumbelSigmoid(scale=gumbel_scale) if gumbel else nn.Sigmoid()
         ]
 
@@ -578,6 +744,11 @@ class OSNet(ModelInterface):
             elif isinstance(m, LCTGate):
                 m.init_params()
 
+        # children of the gates are visited after the gates themselves, so init them separately
+        for m in self.modules():
+            if isinstance(m, ChannelGate):
+                m.init_params()
+
     def _backbone(self, x):
         att_maps = []
 
@@ -628,13 +799,13 @@ class OSNet(ModelInterface):
             y = scale * att_map * x
             out = torch.sum(y, dim=(2, 3))
         elif mode == 'avg':
-            out = F.adaptive_avg_pool2d(x, 1).view(x.size(0), -1)
+            out = x.mean(dim=(2, 3))
         elif mode == 'max':
-            out = F.adaptive_max_pool2d(x, 1).view(x.size(0), -1)
+            out = F.adaptive_max_pool2d(x, 1).flatten(1)
         elif mode == 'avg+max':
-            avg_pool = F.adaptive_avg_pool2d(x, 1)
+            avg_pool = x.mean(dim=(2, 3), keepdim=True)
             max_pool = F.adaptive_max_pool2d(x, 1)
-            out = (avg_pool + max_pool).view(x.size(0), -1)
+            out = (avg_pool + max_pool).flatten(1)
         else:
             raise ValueError(f'Unknown pooling mode: {mode}')
 
@@ -648,7 +819,7 @@ class OSNet(ModelInterface):
         glob_features, head_att_map = self._glob_feature_vector(feature_maps, self.pooling_type, self.head_att)
         embeddings = [fc(glob_features) for fc in self.fc]
 
-        if self.training and len(self.classifier) == 0:
+        if self.training and not self.classifier:
             return embeddings
 
         attr_embeddings = {}
@@ -658,7 +829,7 @@ class OSNet(ModelInterface):
             attr_vector = torch.cat([attr_embeddings[attr_name] for attr_name in self.attr_names], dim=1)
             embeddings = [attr_module(e, attr_vector) for e, attr_module in zip(embeddings, self.attr_att)]
 
-        if not self.training and not self.classification:
+        if not self.training and (not self.classification or self.classifier is None):
             return torch.cat(embeddings, dim=1)
 
         logits = [classifier(embd) for embd, classifier in zip(embeddings, self.classifier)]
@@ -693,12 +864,44 @@ class OSNet(ModelInterface):
 
         return tuple(out_data)
 
+    def fuse(self):
+        """Folds BN layers into the preceding convolutions. Must be called in the eval mode."""
+        for m in self.modules():
+            if isinstance(m, (ConvLayer, Conv1x1, Conv1x1Linear, Conv3x3, LightConv3x3)):
+                m.fuse()
+        for m in self.modules():
+            if isinstance(m, LightConvStreams):
+                m.reset_grouped_params()
+
+        return self.fuse_fc_bn()
+
+    def fuse_fc_bn(self):
+        """Folds BatchNorm1d of the embedding heads into the linear layers. Must be called in the eval mode."""
+        heads = list(self.fc)
+        if self.use_attr:
+            heads += list(self.attr.values())
+
+        for head in heads:
+            for i in range(len(head) - 1):
+                if isinstance(head[i], nn.Linear) and isinstance(head[i + 1], nn.BatchNorm1d):
+                    head[i], head[i + 1] = fuse_linear_bn(head[i], head[i + 1])
+
+        return self
+
+    def remove_classifier(self):
+        """Drops the classification heads to keep only the embedding part for inference."""
+        self.classifier = None
+        if self.use_attr:
+            self.attr_classifier = None
+
+        return self
+
     def train(self, train_mode=True):
         super(OSNet, self).train(train_mode)
 
         if self.bn_eval:
             for m in self.modules():
-                if isinstance(m, nn.BatchNorm2d):
+                if isinstance(m, (nn.BatchNorm2d, nn.SyncBatchNorm)):
                     m.eval()
 
                     if self.bn_frozen:
@@ -709,6 +912,7 @@ class OSNet(ModelInterface):
 
     def load_pretrained_weights(self, pretrained_dict):
         model_dict = self.state_dict()
+        model_sizes = {k: v.size() for k, v in model_dict.items()}
         new_state_dict = OrderedDict()
         matched_layers, discarded_layers = [], []
 
@@ -716,7 +920,10 @@ class OSNet(ModelInterface):
             if k.startswith('module.'):
                 k = k[7:]  # discard module.
 
-            if k in model_dict and model_dict[k].size() == v.size():
+            if k in model_sizes:
+                # gate FC layers were stored as 1x1 convolutions in old checkpoints
+                v = squeeze_to_size(v, model_sizes[k])
+            if k in model_sizes and model_sizes[k] == v.size():
                 new_state_dict[k] = v
                 matched_layers.append(k)
             else:
@@ -72,8 +72,20 @@ class GumbelSigmoid(nn.Module):
         super(GumbelSigmoid, self).__init__()
 
         self.scale = float(scale)
+        self._forward_fn = self._train_forward if self.training else self._eval_forward
 
-    def forward(self, logits):
-        y = logits + gumbel(logits) if self.training else logits
+    def _train_forward(self, logits):
+        return torch.sigmoid(self.scale * (logits + gumbel(logits)))
+
+    def _eval_forward(self, logits):
+        return torch.sigmoid(self.scale * logits)
 
-        return torch.sigmoid(self.scale * y)
+    def train(self, mode=True):
+        super(GumbelSigmoid, self).train(mode)
+        # bind the mode-specific path once instead of checking the mode in every forward
+        self._forward_fn = self._train_forward if mode else self._eval_forward
+
+        return self
+
+    def forward(self, logits):
+        return self._forward_fn(logits)
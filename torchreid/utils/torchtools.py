@@ -18,7 +18,7 @@ from .tools import mkdir_if_missing, check_isfile
 __all__ = [
     'save_checkpoint', 'load_checkpoint', 'resume_from_checkpoint',
     'open_all_layers', 'open_specified_layers', 'count_num_param',
-    'load_pretrained_weights', 'ModelEmaV2'
+    'load_pretrained_weights', 'squeeze_to_size', 'ModelEmaV2'
 ]
 
 
@@ -217,7 +217,7 @@ def open_specified_layers(model, open_layers, strict=True):
         >>> open_layers = ['fc', 'classifier']
         >>> open_specified_layers(model, open_layers)
     """
-    if isinstance(model, nn.DataParallel):
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
         model = model.module
 
     if isinstance(open_layers, str):
@@ -260,7 +260,7 @@ def count_num_param(model):
 
     num_param = sum(p.numel() for p in model.parameters())
 
-    if isinstance(model, nn.DataParallel):
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
         model = model.module
 
     if hasattr(model,
@@ -285,6 +285,20 @@ def _print_loading_weights_inconsistencies(discarded_layers, unmatched_layers):
         )
 
 
+def squeeze_to_size(value, size):
+    r"""Drops trailing singleton dimensions of ``value`` to match ``size``.
+
+    Makes weights of 1x1 convolutions over 1x1 maps loadable into equivalent
+    linear layers. Other tensors are returned unchanged.
+    """
+    num_dims = len(size)
+    if value.dim() > num_dims and value.size()[:num_dims] == size and \
+            all(d == 1 for d in value.size()[num_dims:]):
+        return value.view(size)
+
+    return value
+
+
 def load_pretrained_weights(model, file_path='', pretrained_dict=None):
     r"""Loads pretrianed weights to model.
     Features::
@@ -318,15 +332,20 @@ def load_pretrained_weights(model, file_path='', pretrained_dict=None):
         state_dict = checkpoint
 
     model_dict = model.state_dict()
+    model_sizes = {k: v.size() for k, v in model_dict.items()}
     new_state_dict = OrderedDict()
     matched_layers, discarded_layers = [], []
 
     for k, v in state_dict.items():
-        # discard known prefixes: 'nncf_module.' from NNCF, 'module.' from DataParallel
+        # discard known prefixes: 'nncf_module.' from NNCF, 'module.' from DataParallel,
+        # '_orig_mod.' from torch.compile
         k = _remove_prefix(k, 'nncf_module')
         k = _remove_prefix(k, 'module')
+        k = _remove_prefix(k, '_orig_mod')
 
-        if k in model_dict and model_dict[k].size() == v.size():
+        if k in model_sizes:
+            v = squeeze_to_size(v, model_sizes[k])
+        if k in model_sizes and model_sizes[k] == v.size():
             new_state_dict[k] = v
             matched_layers.append(k)
         else:
@@ -373,6 +392,11 @@ class ModelEmaV2(nn.Module):
     """
     def __init__(self, model, decay=0.9999, device=None):
         super(ModelEmaV2, self).__init__()
+        if isinstance(model, nn.parallel.DistributedDataParallel):
+            # DDP wrapper holds a process group and cannot be copied
+            model = model.module
+        # the same for graphs compiled by torch.compile
+        model = getattr(model, '_orig_mod', model)
         # make a copy of the model for accumulating moving average of weights
         self.module = deepcopy(model)
         self.module.eval()